@@ -5,14 +5,32 @@ Downloads data from Toolbank FTP and generates Matrixify-compatible CSV
 """
 
 import os
+import io
 import csv
 import json
+import hashlib
+import mmap
 import ftplib
 import re
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
 import openpyxl
 
+# Rust-backed xlsx reader, ~10x faster than openpyxl; fall back if missing
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+# C JSON encoder for the row-hash state file; stdlib json works too
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # ============================================================================
 # CONFIGURATION
 # ============================================================================
@@ -33,99 +51,271 @@ FTP_FILES = {
 
 # Output directory
 OUTPUT_DIR = Path(__file__).parent
-KNOWN_SKUS_FILE = OUTPUT_DIR / "known_skus.json"
+KNOWN_SKUS_FILE = OUTPUT_DIR / "known_skus.txt"
+# Pre-migration format, read once if the txt file doesn't exist yet
+LEGACY_KNOWN_SKUS_FILE = OUTPUT_DIR / "known_skus.json"
+ROW_HASHES_FILE = OUTPUT_DIR / "row_hashes.json"
+SYNC_STATE_FILE = OUTPUT_DIR / "sync_state.json"
 
 # ============================================================================
 # HELPER FUNCTIONS
 # ============================================================================
 
+# Compiled once — slugify runs for every product
+_SLUG_STRIP = re.compile(r'[^\w\s-]')
+_SLUG_DASH = re.compile(r'[-\s]+')
+
+
 def slugify(text):
-    text = text.lower().strip()
-    text = re.sub(r'[^\w\s-]', '', text)
-    text = re.sub(r'[-\s]+', '-', text)
-    return text[:200]
+    return _SLUG_DASH.sub('-', _SLUG_STRIP.sub('', text.lower().strip()))[:200]
+
+
+class _TunedFTP(ftplib.FTP):
+    """FTP client with a larger receive buffer on data connections."""
+
+    def ntransfercmd(self, cmd, rest=None):
+        conn, size = super().ntransfercmd(cmd, rest)
+        # Larger receive buffer helps TCP window utilization on the WAN link
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+        return conn, size
 
 
 def connect_ftp():
     print(f"[FTP] Connecting to {FTP_HOST}...")
-    ftp = ftplib.FTP(FTP_HOST)
+    ftp = _TunedFTP(FTP_HOST)
     ftp.login(FTP_USER, FTP_PASS)
+    # Set binary mode once rather than renegotiating per RETR
+    ftp.voidcmd('TYPE I')
     print(f"[FTP] Connected successfully")
     return ftp
 
 
-def download_file(ftp, remote_path, local_path):
+def download_to_memory(ftp, remote_path):
     print(f"[FTP] Downloading {remote_path}...")
-    local_path = Path(local_path)
-    local_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(local_path, 'wb') as f:
-        ftp.retrbinary(f'RETR {remote_path}', f.write)
-    print(f"[FTP] Saved to {local_path}")
-    return local_path
+    buf = io.BytesIO()
+    ftp.retrbinary(f'RETR {remote_path}', buf.write, blocksize=1 << 20)
+    print(f"[FTP] Downloaded {buf.tell()} bytes")
+    buf.seek(0)
+    return buf
+
+
+def fetch_file(remote_path):
+    # Opens its own connection so several fetches can run concurrently —
+    # ftplib control channels are not thread-safe
+    ftp = connect_ftp()
+    try:
+        return download_to_memory(ftp, remote_path)
+    finally:
+        ftp.quit()
+
+
+def feed_digest(buf):
+    # blake2b runs at GB/s through OpenSSL — far cheaper than any parse
+    return hashlib.blake2b(buf.getbuffer(), digest_size=16).hexdigest()
+
+
+def fetch_and_parse(remote_path, parser, ftp=None):
+    """Download remote_path and parse it in the same worker, so each feed's
+    parse starts the moment its transfer ends.
+
+    Uses a dedicated connection unless an existing one is supplied.
+    Returns (content_digest, parsed)."""
+    buf = download_to_memory(ftp, remote_path) if ftp else fetch_file(remote_path)
+    return feed_digest(buf), parser(buf)
+
+
+def fetch_feeds():
+    """Fetch and parse all three feeds concurrently.
+
+    Returns (pricing, stock, products_buf, feed_hashes); the xlsx comes
+    back as a raw buffer because it streams through CSV generation later.
+    Falls back to a single serial connection if the server rejects
+    parallel logins.
+    """
+    try:
+        with ThreadPoolExecutor(max_workers=len(FTP_FILES)) as executor:
+            pricing_future = executor.submit(
+                fetch_and_parse, FTP_FILES['pricing'], parse_pricing_csv)
+            stock_future = executor.submit(
+                fetch_and_parse, FTP_FILES['availability'], parse_availability_csv)
+            products_future = executor.submit(fetch_file, FTP_FILES['products'])
+            pricing_hash, pricing = pricing_future.result()
+            stock_hash, stock = stock_future.result()
+            products_buf = products_future.result()
+    except ftplib.all_errors as e:
+        print(f"[FTP] Parallel fetch failed ({e}), retrying serially...")
+        ftp = connect_ftp()
+        try:
+            pricing_hash, pricing = fetch_and_parse(
+                FTP_FILES['pricing'], parse_pricing_csv, ftp)
+            stock_hash, stock = fetch_and_parse(
+                FTP_FILES['availability'], parse_availability_csv, ftp)
+            products_buf = download_to_memory(ftp, FTP_FILES['products'])
+        finally:
+            ftp.quit()
+            print("[FTP] Disconnected")
+    feed_hashes = {
+        'pricing': pricing_hash,
+        'availability': stock_hash,
+        'products': feed_digest(products_buf),
+    }
+    return pricing, stock, products_buf, feed_hashes
 
 
 # ============================================================================
 # DATA PARSING
 # ============================================================================
 
-def parse_pricing_csv(file_path):
-    pricing = {}
-    with open(file_path, 'r', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
+def parse_pricing_csv(source):
+    """Return {sku: (trade_price, rrp)}.
+
+    Numeric conversion happens in bulk via map(float, ...) after the scan,
+    so the per-row Python work is just three list appends.
+    """
+    skus, prices, rrps = [], [], []
+    with io.TextIOWrapper(source, encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        i_sku = header.index('stock_no')
+        i_price = header.index('price')
+        i_rrp = header.index('rrp')
+        min_len = max(i_sku, i_price, i_rrp) + 1
         for row in reader:
-            sku = row.get('stock_no', '').strip()
+            if len(row) < min_len:
+                continue
+            sku = row[i_sku].strip()
             if sku:
-                pricing[sku] = {
-                    'trade_price': float(row.get('price', 0) or 0),
-                    'rrp': float(row.get('rrp', 0) or 0),
-                }
+                skus.append(sku)
+                prices.append(row[i_price])
+                rrps.append(row[i_rrp])
+    pricing = dict(zip(skus, zip(map(float, (p.strip() or '0' for p in prices)),
+                                 map(float, (r.strip() or '0' for r in rrps)))))
     print(f"[DATA] Loaded {len(pricing)} pricing records")
     return pricing
 
 
-def parse_availability_csv(file_path):
-    stock = {}
-    with open(file_path, 'r', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
+def parse_availability_csv(source):
+    skus, qtys = [], []
+    with io.TextIOWrapper(source, encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        i_sku = header.index('stock_no')
+        i_qty = header.index('cstock')
+        min_len = max(i_sku, i_qty) + 1
         for row in reader:
-            sku = row.get('stock_no', '').strip()
+            if len(row) < min_len:
+                continue
+            sku = row[i_sku].strip()
             if sku:
-                qty = row.get('cstock', '0').strip()
-                stock[sku] = int(float(qty)) if qty else 0
+                skus.append(sku)
+                qtys.append(row[i_qty])
+    stock = dict(zip(skus, map(int, map(float, (q.strip() or '0' for q in qtys)))))
     print(f"[DATA] Loaded {len(stock)} stock records")
     return stock
 
 
-def parse_products_xlsx(file_path):
-    products = {}
-    print(f"[DATA] Loading Excel file...")
-    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
-    sheet = wb.active
-    headers = None
-    for i, row in enumerate(sheet.iter_rows(values_only=True)):
-        if i == 0:
-            headers = [str(h).strip() if h else f'col_{j}' for j, h in enumerate(row)]
+@dataclass(slots=True)
+class Product:
+    """One catalogue entry; slots keep it at roughly half a dict's size
+    and make field access a fixed-offset load instead of a hash lookup."""
+    sku: str
+    title: str
+    description: str
+    vendor: str
+    barcode: str
+    weight: float
+    image_ref: str
+    discontinued: bool
+    class_a: str
+    class_b: str
+    class_c: str
+
+
+def _s(value):
+    # Cell values arrive as str, int, float or None; str(None) would
+    # otherwise leak the literal 'None' into the output
+    if value is None:
+        return ''
+    if type(value) is str:
+        return value.strip()
+    # Whole-number cells can come back as floats; '4003318003400.0'
+    # is not a barcode
+    if type(value) is float and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _f(value):
+    return float(value) if value else 0.0
+
+
+def iter_xlsx_rows(source):
+    # source is a path or a file-like object
+    if CalamineWorkbook is not None:
+        print(f"[DATA] Loading Excel file (calamine)...")
+        if hasattr(source, 'read'):
+            wb = CalamineWorkbook.from_filelike(source)
+        else:
+            wb = CalamineWorkbook.from_path(str(source))
+        yield from wb.get_sheet_by_index(0).to_python()
+    else:
+        print(f"[DATA] Loading Excel file (openpyxl)...")
+        wb = openpyxl.load_workbook(source, read_only=True, data_only=True)
+        yield from wb.active.iter_rows(values_only=True)
+        wb.close()
+
+
+def iter_products(source):
+    """Yield Product records straight off the sheet — no materialized dict,
+    so the xlsx parse streams into CSV generation in one pass."""
+    rows = iter_xlsx_rows(source)
+    headers = [str(h).strip() if h else f'col_{j}' for j, h in enumerate(next(rows))]
+    # Resolve column positions once so the row loop indexes tuples directly
+    # instead of building a dict per row
+    idx = {name: j for j, name in enumerate(headers)}
+    i_sku = idx['StockCode']
+    i_title = idx['Product Name']
+    i_desc = idx['ProductDescription']
+    i_vendor = idx['Brand_Name']
+    i_barcode = idx['RetailerBarcode']
+    i_weight = idx['Weight']
+    i_image = idx['ImageRef']
+    i_disc = idx['DiscontinuedFlag']
+    i_class_a = idx['ClassAName']
+    i_class_b = idx['ClassBName']
+    i_class_c = idx['ClassCName']
+    width = len(headers)
+
+    # Vendor and class names repeat across thousands of products; pool them
+    # so duplicates share one str object instead of 30k fresh copies
+    pool = {}
+
+    def intern(value):
+        s = _s(value)
+        return pool.setdefault(s, s)
+
+    for row in rows:
+        # calamine trims trailing empty cells, so pad short rows
+        if len(row) < width:
+            row = tuple(row) + ('',) * (width - len(row))
+        if not row[i_sku]:
             continue
-        row_dict = dict(zip(headers, row))
-        sku = str(row_dict.get('StockCode', '')).strip()
+        sku = _s(row[i_sku])
         if not sku:
             continue
-        products[sku] = {
-            'sku': sku,
-            'title': str(row_dict.get('Product Name', '')).strip(),
-            'description': str(row_dict.get('ProductDescription', '') or ''),
-            'vendor': str(row_dict.get('Brand_Name', '')).strip(),
-            'barcode': str(row_dict.get('RetailerBarcode', '')).strip(),
-            'weight': float(row_dict.get('Weight', 0) or 0),
-            'image_ref': str(row_dict.get('ImageRef', '')).strip(),
-            'discontinued': str(row_dict.get('DiscontinuedFlag', '0')).strip() == '1',
-            'class_a': str(row_dict.get('ClassAName', '')).strip(),
-            'class_b': str(row_dict.get('ClassBName', '')).strip(),
-            'class_c': str(row_dict.get('ClassCName', '')).strip(),
-        }
-    wb.close()
-    print(f"[DATA] Loaded {len(products)} products")
-    return products
+        yield Product(
+            sku,
+            _s(row[i_title]),
+            str(row[i_desc] or ''),
+            intern(row[i_vendor]),
+            _s(row[i_barcode]),
+            _f(row[i_weight]),
+            _s(row[i_image]),
+            _s(row[i_disc]) == '1',
+            intern(row[i_class_a]),
+            intern(row[i_class_b]),
+            intern(row[i_class_c]),
+        )
 
 
 # ============================================================================
@@ -134,34 +324,90 @@ def parse_products_xlsx(file_path):
 
 def load_known_skus():
     if KNOWN_SKUS_FILE.exists():
-        with open(KNOWN_SKUS_FILE, 'r') as f:
-            data = json.load(f)
-            return set(data.get('skus', []))
+        with open(KNOWN_SKUS_FILE, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return set()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                lines = mm[:].decode('utf-8').splitlines()
+            return {line for line in lines if not line.startswith('#')}
+    if LEGACY_KNOWN_SKUS_FILE.exists():
+        # One-shot migration from the old JSON format
+        with open(LEGACY_KNOWN_SKUS_FILE, 'r') as f:
+            return set(json.load(f).get('skus', []))
     return set()
 
 
 def save_known_skus(skus):
-    with open(KNOWN_SKUS_FILE, 'w') as f:
-        json.dump({'skus': list(skus), 'updated': datetime.now().isoformat()}, f)
+    with open(KNOWN_SKUS_FILE, 'wb') as f:
+        f.write(f'# updated={datetime.now().isoformat()}\n'.encode('utf-8'))
+        f.write('\n'.join(skus).encode('utf-8'))
     print(f"[DATA] Saved {len(skus)} known SKUs")
 
 
+def load_sync_state():
+    if SYNC_STATE_FILE.exists():
+        with open(SYNC_STATE_FILE, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def save_sync_state(feed_hashes):
+    with open(SYNC_STATE_FILE, 'w') as f:
+        json.dump(feed_hashes, f)
+
+
+def load_row_hashes():
+    if ROW_HASHES_FILE.exists():
+        if orjson is not None:
+            return orjson.loads(ROW_HASHES_FILE.read_bytes())
+        with open(ROW_HASHES_FILE, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def save_row_hashes(hashes):
+    if orjson is not None:
+        ROW_HASHES_FILE.write_bytes(orjson.dumps(hashes))
+    else:
+        with open(ROW_HASHES_FILE, 'w') as f:
+            json.dump(hashes, f)
+    print(f"[DATA] Saved {len(hashes)} row hashes")
+
+
 # ============================================================================
 # CSV GENERATION
 # ============================================================================
 
-def generate_matrixify_csv(products, pricing, stock, known_skus, output_path):
-    all_skus = set(products.keys())
-    new_skus = all_skus - known_skus
-    existing_skus = all_skus & known_skus
-    
-    print(f"[SYNC] Total products: {len(all_skus)}")
-    print(f"[SYNC] New products: {len(new_skus)}")
-    print(f"[SYNC] Existing products: {len(existing_skus)}")
-    
-    discontinued_skus = {sku for sku, p in products.items() if p.get('discontinued')}
-    print(f"[SYNC] Discontinued: {len(discontinued_skus)}")
-    
+# Inventory tracker / policy / fulfillment service — constant for every row
+_ROW_CONSTS = ('shopify', 'deny', 'manual')
+
+# (trade_price, rrp) fallback for SKUs missing from the pricing feed
+_NO_PRICE = (0.0, 0.0)
+
+# (command, status, published) by (is_new, in_stock); discontinued rows
+# short-circuit before this table applies
+_CMD_STATUS = {
+    (True, True): ('MERGE', 'active', 'TRUE'),
+    (True, False): ('MERGE', 'draft', 'FALSE'),
+    (False, True): ('UPDATE', 'active', 'TRUE'),
+    (False, False): ('UPDATE', 'draft', 'FALSE'),
+}
+
+
+def generate_matrixify_csv(products, pricing, stock, known_skus, old_hashes,
+                           output_path):
+    """Write the Matrixify CSV from an iterable of Product records.
+
+    Accepts the iter_products generator directly, so products stream off
+    the sheet into the writer without ever being held in full.
+    """
+    total_count = 0
+    new_count = 0
+    unchanged_count = 0
+    discontinued_count = 0
+    new_hashes = {}
+    updated_known = known_skus.copy()
+
     headers = [
         'Command', 'Handle', 'Title', 'Body (HTML)', 'Vendor', 'Type', 'Tags',
         'Published', 'Variant SKU', 'Variant Grams', 'Variant Inventory Tracker',
@@ -170,99 +416,120 @@ def generate_matrixify_csv(products, pricing, stock, known_skus, output_path):
         'Variant Barcode', 'Image Src', 'Image Position', 'Status', 'Variant Inventory Qty'
     ]
     
-    rows = []
     in_stock_count = 0
     zero_stock_count = 0
-    
-    for sku, product in products.items():
-        price_data = pricing.get(sku, {})
-        stock_qty = stock.get(sku, 0)
-        
-        is_new = sku in new_skus
-        is_discontinued = product.get('discontinued', False)
-        
-        if is_discontinued:
-            command = 'DELETE'
-            status = 'archived'
-            published = 'FALSE'
-        elif is_new:
-            command = 'MERGE'
+    row_count = 0
+
+    csv_path = output_path / "toolbank_import.csv"
+    # 1 MiB buffer so row writes coalesce into few large write() syscalls
+    with open(csv_path, 'w', newline='', encoding='utf-8',
+              buffering=1 << 20) as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+
+        # Hoist per-row attribute lookups out of the hot loop, and batch rows
+        # so csv encoding runs one writerows call per chunk instead of one
+        # writerow per row
+        make_handle = slugify
+        pricing_get = pricing.get
+        stock_get = stock.get
+        image_base = IMAGE_BASE_URL
+        # Class names are low-cardinality (and interned at parse time), so the
+        # joined tag string repeats across thousands of rows — build each
+        # distinct combination once
+        tag_cache = {}
+        pending = []
+        writerow = pending.append
+        flush = writer.writerows
+
+        for product in products:
+            if len(pending) >= 1000:
+                flush(pending)
+                pending.clear()
+            sku = product.sku
+            total_count += 1
+            stock_qty = stock_get(sku, 0)
+
+            if product.discontinued:
+                discontinued_count += 1
+                # Never imported, so Shopify has nothing to delete
+                if sku not in known_skus:
+                    continue
+                # Matrixify only needs the command and an identifier to
+                # delete; skip the tags/handle/image work entirely
+                writerow(('DELETE', '', '', '', '', '', '', 'FALSE', sku, '',
+                          '', '', '', '', '', '', '', '', '', '', 'archived', ''))
+                row_count += 1
+                continue
+
+            is_new = sku not in known_skus
+
+            if is_new:
+                new_count += 1
+
+            updated_known.add(sku)
+
             # Stock = 0 → draft, Stock > 0 → active
-            if stock_qty > 0:
-                status = 'active'
-                published = 'TRUE'
+            in_stock = stock_qty > 0
+            command, status, published = _CMD_STATUS[is_new, in_stock]
+            if in_stock:
                 in_stock_count += 1
             else:
-                status = 'draft'
-                published = 'FALSE'
                 zero_stock_count += 1
-        else:
-            command = 'UPDATE'
-            # Stock = 0 → draft, Stock > 0 → active
-            if stock_qty > 0:
-                status = 'active'
-                published = 'TRUE'
-                in_stock_count += 1
+
+            # Price: RRP for new products, empty for existing (preserves your
+            # prices)
+            if is_new:
+                price = round(pricing_get(sku, _NO_PRICE)[1], 2)
             else:
-                status = 'draft'
-                published = 'FALSE'
-                zero_stock_count += 1
-        
-        # Price: RRP for new products, empty for existing (preserves your prices)
-        if is_new:
-            price = round(price_data.get('rrp', 0), 2)
-        else:
-            price = ''
-        
-        tags = [t for t in [product['class_a'], product['class_b'], product['class_c']] if t]
-        tags.append('Toolbank')
-        if is_new:
-            tags.append('New-Import')
-        
-        handle = slugify(f"{product['title']}-{sku}")
-        
-        # Image URL - Cloudflare R2
-        image_ref = product['image_ref'].strip() or sku
-        image_url = f"{IMAGE_BASE_URL}{image_ref}.JPG"
-        
-        row = {
-            'Command': command,
-            'Handle': handle,
-            'Title': product['title'],
-            'Body (HTML)': product['description'],
-            'Vendor': product['vendor'],
-            'Type': product.get('class_b', ''),
-            'Tags': ', '.join(tags),
-            'Published': published,
-            'Variant SKU': sku,
-            'Variant Grams': int(product.get('weight', 0) * 1000),
-            'Variant Inventory Tracker': 'shopify',
-            'Variant Inventory Policy': 'deny',
-            'Variant Fulfillment Service': 'manual',
-            'Variant Price': price,
-            'Variant Compare At Price': '',
-            'Variant Requires Shipping': 'TRUE',
-            'Variant Taxable': 'TRUE',
-            'Variant Barcode': product.get('barcode', ''),
-            'Image Src': image_url,
-            'Image Position': '1',
-            'Status': status,
-            'Variant Inventory Qty': stock_qty,
-        }
-        rows.append(row)
-    
+                price = ''
+
+            tag_key = (product.class_a, product.class_b, product.class_c, is_new)
+            tags_str = tag_cache.get(tag_key)
+            if tags_str is None:
+                tags = [t for t in tag_key[:3] if t]
+                tags.append('Toolbank')
+                if is_new:
+                    tags.append('New-Import')
+                tags_str = tag_cache[tag_key] = ', '.join(tags)
+
+            handle = make_handle(f"{product.title}-{sku}")
+
+            # Image URL - Cloudflare R2; image_ref was already stripped at
+            # parse time
+            image_url = image_base + (product.image_ref or sku) + '.JPG'
+
+            # Positional tuple in `headers` order — no per-row dict
+            row = (
+                command, handle, product.title, product.description,
+                product.vendor, product.class_b, tags_str, published,
+                sku, int(product.weight * 1000), *_ROW_CONSTS, price, '',
+                'TRUE', 'TRUE', product.barcode, image_url, '1', status,
+                stock_qty,
+            )
+
+            # Skip existing products whose row is identical to the last sync —
+            # typical daily deltas are a small fraction of the catalogue
+            digest = hashlib.blake2b(repr(row).encode(),
+                                     digest_size=16).hexdigest()
+            new_hashes[sku] = digest
+            if not is_new and old_hashes.get(sku) == digest:
+                unchanged_count += 1
+                continue
+            writerow(row)
+            row_count += 1
+
+        flush(pending)
+
+    print(f"[SYNC] Total products: {total_count}")
+    print(f"[SYNC] New products: {new_count}")
+    print(f"[SYNC] Existing products: {total_count - new_count}")
+    print(f"[SYNC] Discontinued: {discontinued_count}")
     print(f"[SYNC] In stock (active): {in_stock_count}")
     print(f"[SYNC] Zero stock (draft): {zero_stock_count}")
-    
-    csv_path = output_path / "toolbank_import.csv"
-    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=headers)
-        writer.writeheader()
-        writer.writerows(rows)
-    
-    print(f"[OUTPUT] Generated {csv_path} with {len(rows)} products")
-    updated_known = known_skus | (all_skus - discontinued_skus)
-    return csv_path, updated_known
+    print(f"[SYNC] Unchanged (skipped): {unchanged_count}")
+    print(f"[OUTPUT] Generated {csv_path} with {row_count} products")
+    return csv_path, updated_known, new_hashes
 
 
 # ============================================================================
@@ -277,37 +544,28 @@ def main():
     
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     known_skus = load_known_skus()
+    old_hashes = load_row_hashes()
     print(f"[INIT] Known SKUs: {len(known_skus)}")
     
     try:
-        ftp = connect_ftp()
-        pricing_file = OUTPUT_DIR / "temp_pricing.csv"
-        download_file(ftp, FTP_FILES['pricing'], pricing_file)
-        products_file = OUTPUT_DIR / "temp_products.xlsx"
-        download_file(ftp, FTP_FILES['products'], products_file)
-        availability_file = OUTPUT_DIR / "temp_availability.csv"
-        download_file(ftp, FTP_FILES['availability'], availability_file)
-        ftp.quit()
-        print("[FTP] Disconnected")
+        pricing, stock, products_buf, feed_hashes = fetch_feeds()
     except Exception as e:
         print(f"[ERROR] FTP failed: {e}")
         raise
-    
-    pricing = parse_pricing_csv(pricing_file)
-    stock = parse_availability_csv(availability_file)
-    products = parse_products_xlsx(products_file)
-    
-    output_csv, updated_known = generate_matrixify_csv(
-        products, pricing, stock, known_skus, OUTPUT_DIR
+
+    if feed_hashes == load_sync_state():
+        print("[SYNC] All feeds unchanged since last run — nothing to do")
+        return
+
+    output_csv, updated_known, new_hashes = generate_matrixify_csv(
+        iter_products(products_buf), pricing, stock,
+        known_skus, old_hashes, OUTPUT_DIR
     )
-    
+
     save_known_skus(updated_known)
-    
-    # Clean up temp files
-    pricing_file.unlink(missing_ok=True)
-    products_file.unlink(missing_ok=True)
-    availability_file.unlink(missing_ok=True)
-    
+    save_row_hashes(new_hashes)
+    save_sync_state(feed_hashes)
+
     print("=" * 60)
     print("SYNC COMPLETE")
     print("=" * 60)